@@ -7,10 +7,13 @@ By gduarte
 
 import os
 import sys
+import re
 import csv
 import math
 import json
-import rhinoscriptsyntax as rs
+import bisect
+import functools
+from collections import Counter
 
 ver = "0.5"
 
@@ -49,16 +52,27 @@ ROOM_TYPE_KEYWORDS = {
     'utility': ['storage', 'closet', 'laundry', 'utility', 'pantry', 'despensa', 'lavanderia']
 }
 
+# One compiled pattern for all keywords. Each room type is a lookahead
+# alternative tried in ROOM_TYPE_KEYWORDS order, so the first matching
+# type wins, same as scanning the keyword lists one by one.
+ROOM_TYPE_RE = re.compile(
+    '^(?:' + '|'.join(
+        '(?=.*?(?P<{0}>{1}))'.format(room_type, '|'.join(re.escape(k) for k in keywords))
+        for room_type, keywords in ROOM_TYPE_KEYWORDS.items()
+    ) + ')',
+    re.IGNORECASE | re.DOTALL
+)
+
 # Fixed proportion ratios per room type (width:depth)
 ROOM_TYPE_RATIOS = {
-    'living': [(4, 3), (5, 4), (3, 2)],
-    'bedroom': [(3, 2), (4, 3), (5, 4)],
-    'kitchen': [(5, 3), (3, 2), (4, 3)],
-    'bathroom': [(3, 2), (2, 1), (5, 4)],
-    'office': [(3, 2), (4, 3), (5, 4)],
-    'circulation': [(2, 1), (3, 1), (5, 2)],
-    'utility': [(2, 1), (3, 2), (1, 1)],
-    'default': [(3, 2), (4, 3), (5, 4), (1, 1)]
+    'living': ((4, 3), (5, 4), (3, 2)),
+    'bedroom': ((3, 2), (4, 3), (5, 4)),
+    'kitchen': ((5, 3), (3, 2), (4, 3)),
+    'bathroom': ((3, 2), (2, 1), (5, 4)),
+    'office': ((3, 2), (4, 3), (5, 4)),
+    'circulation': ((2, 1), (3, 1), (5, 2)),
+    'utility': ((2, 1), (3, 2), (1, 1)),
+    'default': ((3, 2), (4, 3), (5, 4), (1, 1))
 }
 
 ROOM_TYPE_CONSTRAINTS = {
@@ -74,6 +88,15 @@ ROOM_TYPE_CONSTRAINTS = {
 
 MIN_WALL_LENGTH = 120  # cm
 MAX_WALL_LENGTH = 1000  # cm - reasonable maximum
+CSV_BUFFER_SIZE = 1 << 23  # bytes - read the room program in large chunks
+
+# Candidate modules: 120, 130, 140, 150, 160, 170, 180, 190, 200, 225, 250, 300, etc.
+TEST_MODULES = tuple(
+    list(range(MIN_WALL_LENGTH, 201, 10)) +  # Fine increments from MIN_WALL_LENGTH to 200cm
+    list(range(225, 301, 25)) +              # Coarser increments from 200cm to 300cm
+    list(range(350, 501, 50))                # Even coarser for larger modules
+)
+TOP_MODULE_CANDIDATES = 5  # candidates listed in the module report
 
 # Room category colors (pastel RGB)
 ROOM_COLORS = {
@@ -97,13 +120,39 @@ ROOM_CATEGORIES = {
 # HELPER FUNCTIONS
 # ============================================================================
 
+def clear_console():
+    """Clear the terminal (skipped in auto mode, where nobody is reading it)"""
+    if not AUTO_MODE:
+        os.system("cls" if os.name == "nt" else "clear")
+
+def pick_csv_file():
+    """Ask for the room program CSV (Rhino is only imported when needed)"""
+    import rhinoscriptsyntax as rs
+    return rs.OpenFileName("Select CSV File", "CSV Files (*.csv)|*.csv||")
+
+def print_lines(lines):
+    """Write a block of output lines with a single console call"""
+    sys.stdout.write("\n".join(lines) + "\n")
+
+def memoize(func):
+    """Cache results by positional arguments (no lru_cache on IronPython 2.7)"""
+    cache = {}
+    
+    @functools.wraps(func)
+    def wrapper(*args):
+        try:
+            return cache[args]
+        except KeyError:
+            result = cache[args] = func(*args)
+            return result
+    
+    return wrapper
+
 def detect_room_type(room_name):
     """Detect room type from name using keywords"""
-    room_name_lower = room_name.lower()
-    for room_type, keywords in ROOM_TYPE_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in room_name_lower:
-                return room_type
+    match = ROOM_TYPE_RE.match(room_name)
+    if match:
+        return match.lastgroup
     return 'default'
 
 def get_room_type_ratios(room_type):
@@ -114,86 +163,148 @@ def get_aspect_constraints(room_type):
     """Get aspect ratio constraints for room type"""
     return ROOM_TYPE_CONSTRAINTS.get(room_type, ROOM_TYPE_CONSTRAINTS['default'])
 
+# Room types interned to small integer ids for the grid calculations
+ROOM_TYPES = sorted(ROOM_TYPE_RATIOS)
+ROOM_TYPE_IDS = dict((room_type, i) for i, room_type in enumerate(ROOM_TYPES))
+
+# Ratios and aspect constraints resolved once per room type id at load time
+ROOM_TYPE_PROFILES = [
+    (get_room_type_ratios(room_type), get_aspect_constraints(room_type))
+    for room_type in ROOM_TYPES
+]
+
+# Category and layer name per room type, resolved once for drawing
+ROOM_TYPE_LAYERS = dict(
+    (room_type, (category, "Program_{0}".format(category.capitalize())))
+    for room_type, category in ROOM_CATEGORIES.items()
+)
+
 # ============================================================================
 # MODULAR GRID SYSTEM - CORE ALGORITHM
 # ============================================================================
 
 def round_to_module(value, module):
-    """Round value to nearest module"""
+    """Round value to nearest module (halves round up), as an integer multiple"""
     if module <= 0:
         return value
-    result = round(value / module) * module
+    result = int(float(value) / module + 0.5) * module
     return max(result, module)  # At least one module unit
 
-def calculate_room_dimensions_on_grid(area_m2, room_type, module_cm):
+@memoize
+def calculate_ideal_dimensions(area_m2, type_id):
+    """
+    Calculate unsnapped room dimensions for each preferred ratio
+    
+    These do not depend on the module, so the module search computes
+    them once per room instead of once per candidate module.
+    
+    Returns:
+        Tuple of (length_cm, width_cm), in ratio preference order
+    """
+    area_cm2 = area_m2 * 10000
+    preferred_ratios = ROOM_TYPE_PROFILES[type_id][0]
+    
+    ideal_dims = []
+    for length_ratio, width_ratio in preferred_ratios:
+        length = math.sqrt(area_cm2 * length_ratio / width_ratio)
+        width = area_cm2 / length
+        ideal_dims.append((length, width))
+    
+    return tuple(ideal_dims)
+
+@memoize
+def calculate_room_dimensions_on_grid(area_m2, type_id, module_cm):
     """
     Calculate room dimensions using preferred ratios,
     snapped to modular grid
     
+    Results are cached, so identical rooms and the final apply pass
+    reuse the work done during the module search.
+    
     Args:
         area_m2: Room area in square meters
-        room_type: Room type string
+        type_id: Room type id (see ROOM_TYPE_IDS)
         module_cm: Module size in centimeters
     
     Returns:
         (length_cm, width_cm) or None if impossible
     """
     area_cm2 = area_m2 * 10000
-    preferred_ratios = get_room_type_ratios(room_type)
-    min_aspect, max_aspect = get_aspect_constraints(room_type)
+    min_aspect, max_aspect = ROOM_TYPE_PROFILES[type_id][1]
+    ideal_dims = calculate_ideal_dimensions(area_m2, type_id)
     
-    best_dims = None
+    # Smallest multiple of the module that satisfies MIN_WALL_LENGTH
+    min_wall_snapped = ((MIN_WALL_LENGTH + module_cm - 1) // module_cm) * module_cm
+    
+    best_length = best_width = None
     best_error = float('inf')
     
-    for ratio in preferred_ratios:
-        length_ratio, width_ratio = ratio
+    for ratio_preference, (length, width) in enumerate(ideal_dims):
+        # Snap to modular grid, never below the minimum wall length
+        length_snapped = max(round_to_module(length, module_cm), min_wall_snapped)
+        width_snapped = max(round_to_module(width, module_cm), min_wall_snapped)
         
-        # Calculate ideal dimensions from ratio
-        length = math.sqrt(area_cm2 * length_ratio / width_ratio)
-        width = area_cm2 / length
-        
-        # Snap to modular grid
-        length_snapped = round_to_module(length, module_cm)
-        width_snapped = round_to_module(width, module_cm)
-        
-        # Ensure minimum dimensions
-        length_snapped = max(length_snapped, MIN_WALL_LENGTH)
-        width_snapped = max(width_snapped, MIN_WALL_LENGTH)
-        
-        # Safety check: ensure non-zero dimensions
-        if length_snapped <= 0 or width_snapped <= 0:
-            continue
-        
-        # Ensure they're multiples of module
-        if length_snapped % module_cm != 0:
-            length_snapped = round_to_module(length_snapped, module_cm)
-        if width_snapped % module_cm != 0:
-            width_snapped = round_to_module(width_snapped, module_cm)
-        
-        # Double-check after adjustment
-        if length_snapped <= 0 or width_snapped <= 0:
+        # Check aspect ratio constraints before doing any scoring
+        aspect = length_snapped / float(width_snapped)
+        if aspect < min_aspect or aspect > max_aspect:
             continue
         
         # Calculate actual area and error
         actual_area_cm2 = length_snapped * width_snapped
         area_error = abs(actual_area_cm2 - area_cm2)
         
-        # Check aspect ratio constraints
-        aspect = float(length_snapped) / float(width_snapped)
-        if aspect < min_aspect or aspect > max_aspect:
-            continue
-        
         # Score: prefer smaller area error and earlier ratios
-        ratio_preference = preferred_ratios.index(ratio)
         score = area_error + (ratio_preference * 10000)
         
         if score < best_error:
             best_error = score
-            best_dims = (length_snapped, width_snapped)
+            best_length = length_snapped
+            best_width = width_snapped
+        
+        # Later ratios carry a penalty of at least (ratio_preference + 1) * 10000,
+        # so none of them can beat a score already within that bound
+        if best_error <= (ratio_preference + 1) * 10000:
+            break
+    
+    if best_length is None:
+        return None
+    return (best_length, best_width)
+
+def score_module(rooms, module_cm, bound=float('inf')):
+    """
+    Score one candidate module over all rooms
+    
+    Args:
+        rooms: List of (area_m2, type_id) pairs
+        module_cm: Module size in centimeters
+        bound: Give up once the total error reaches this value
+    
+    Returns:
+        (total_error, room_dims) with the total area error in square
+        meters and each room's (length_cm, width_cm), or None if any
+        room cannot be dimensioned on this module or the bound is reached
+    """
+    total_error = 0
+    room_dims = []
+    
+    for area_m2, type_id in rooms:
+        dims = calculate_room_dimensions_on_grid(area_m2, type_id, module_cm)
+        
+        # A module must work for all rooms, so the first failure rules it out
+        if not dims:
+            return None
+        
+        actual_area = (dims[0] * dims[1]) / 10000.0
+        total_error += abs(actual_area - area_m2)
+        room_dims.append(dims)
+        
+        # Errors only add up, so this module can no longer qualify
+        if total_error >= bound:
+            return None
     
-    return best_dims
+    return total_error, room_dims
 
-def find_optimal_module(rooms_data):
+def find_optimal_module(areas, type_ids):
     """
     Find the optimal common module that:
     1. Works for all rooms
@@ -201,64 +312,56 @@ def find_optimal_module(rooms_data):
     3. Creates reasonable room proportions
     
     Tests all possible modules from MIN_WALL_LENGTH up
+    
+    Args:
+        areas: Room areas in square meters
+        type_ids: Room type ids, parallel to areas
+    
+    Returns:
+        (module_cm, room_dims) where room_dims are the rooms' dimensions
+        on that module, or None when falling back to the default module
     """
     
-    if not rooms_data or len(rooms_data) == 0:
+    if not areas or len(areas) == 0:
         print("ERROR: No rooms to process!")
-        return 150  # Default fallback
+        return 150, None  # Default fallback
     
     print("\n" + "="*70)
     print("FINDING OPTIMAL MODULAR GRID")
     print("="*70)
     
-    # Test modules: 120, 130, 140, 150, 160, 170, 180, 190, 200, 225, 250, 300, etc.
-    test_modules = []
-    
-    # Fine increments from MIN_WALL_LENGTH to 200cm
-    for m in range(MIN_WALL_LENGTH, 201, 10):
-        test_modules.append(m)
-    
-    # Coarser increments from 200cm to 300cm
-    for m in range(225, 301, 25):
-        test_modules.append(m)
-    
-    # Even coarser for larger modules
-    for m in range(350, 501, 50):
-        test_modules.append(m)
-    
     best_module = None
+    best_dims = None
     best_total_error = float('inf')
     best_success_rate = 0
     
+    # Candidates ranked by average error as they are found
     results = []
-    
-    for module in test_modules:
-        total_error = 0
-        successful_rooms = 0
-        failed_rooms = []
+    result_errors = []  # parallel to results, kept sorted
+    
+    # Loop invariants of the sweep, built once rather than per module
+    rooms = list(zip(areas, type_ids))
+    room_count = len(rooms)
+    
+    for module in TEST_MODULES:
+        # Once the report is full, a module that cannot beat the last
+        # listed candidate can neither be shown nor selected
+        bound = float('inf')
+        if len(results) >= TOP_MODULE_CANDIDATES:
+            bound = results[TOP_MODULE_CANDIDATES - 1]['total_error']
         
-        for room in rooms_data:
-            dims = calculate_room_dimensions_on_grid(
-                room['area_m2'], 
-                room['room_type'], 
-                module
-            )
-            
-            if dims:
-                actual_area = (dims[0] * dims[1]) / 10000.0
-                error = abs(actual_area - room['area_m2'])
-                total_error += error
-                successful_rooms += 1
-            else:
-                failed_rooms.append(room['name'])
-        
-        success_rate = successful_rooms / float(len(rooms_data))
+        scored = score_module(rooms, module, bound)
         
         # Only consider modules that work for all rooms
-        if success_rate == 1.0:
-            avg_error = total_error / len(rooms_data)
+        if scored is not None:
+            total_error, room_dims = scored
+            success_rate = 1.0
+            avg_error = total_error / room_count
             
-            results.append({
+            # Insert after equal errors so ties stay in module order
+            rank = bisect.bisect_right(result_errors, avg_error)
+            result_errors.insert(rank, avg_error)
+            results.insert(rank, {
                 'module': module,
                 'avg_error': avg_error,
                 'total_error': total_error,
@@ -269,118 +372,155 @@ def find_optimal_module(rooms_data):
             if total_error < best_total_error:
                 best_total_error = total_error
                 best_module = module
+                best_dims = room_dims
                 best_success_rate = success_rate
     
-    # Show top 5 candidates
+    # Show top candidates
     if results:
-        results.sort(key=lambda x: x['avg_error'])
-        print("\nTop 5 module candidates:")
-        for i, r in enumerate(results[:5], 1):
-            print("  {0}. Module: {1}cm, Avg error: {2:.2f}m2, Total: {3:.2f}m2".format(
+        lines = ["\nTop {0} module candidates:".format(TOP_MODULE_CANDIDATES)]
+        for i, r in enumerate(results[:TOP_MODULE_CANDIDATES], 1):
+            lines.append("  {0}. Module: {1}cm, Avg error: {2:.2f}m2, Total: {3:.2f}m2".format(
                 i, int(r['module']), r['avg_error'], r['total_error']))
         
-        print("\nSelected module: {0}cm".format(int(best_module)))
-        print("Success rate: {0:.0f}%".format(best_success_rate * 100))
-        print("Average area error: {0:.2f}m2".format(best_total_error / len(rooms_data)))
+        lines.append("\nSelected module: {0}cm".format(int(best_module)))
+        lines.append("Success rate: {0:.0f}%".format(best_success_rate * 100))
+        lines.append("Average area error: {0:.2f}m2".format(best_total_error / room_count))
+        print_lines(lines)
     else:
         print("\nWARNING: No module found that works for all rooms!")
         print("Using fallback: 150cm")
         best_module = 150
     
-    return best_module
+    return best_module, best_dims
+
+def calculate_modular_dimensions(areas, type_ids, module_cm):
+    """
+    Dimension all rooms on the modular grid
+    
+    Args:
+        areas: Room areas in square meters
+        type_ids: Room type ids, parallel to areas
+        module_cm: Module size in centimeters
+    
+    Returns:
+        List of (length_cm, width_cm) or None, parallel to areas
+    """
+    return [
+        calculate_room_dimensions_on_grid(area_m2, type_id, module_cm)
+        for area_m2, type_id in zip(areas, type_ids)
+    ]
 
-def apply_modular_dimensions(rooms_data, module_cm):
+def apply_modular_dimensions(rooms_data, room_dims, module_cm):
     """
     Apply modular grid to all rooms
+    
+    Args:
+        rooms_data: Room dicts, updated in place
+        room_dims: Dimensions from calculate_modular_dimensions, parallel to rooms_data
+        module_cm: Module size in centimeters
+    
+    Returns:
+        The rooms that could be dimensioned
     """
-    print("\n" + "="*70)
-    print("APPLYING MODULAR GRID: {0}cm".format(int(module_cm)))
-    print("="*70)
+    lines = [
+        "\n" + "="*70,
+        "APPLYING MODULAR GRID: {0}cm".format(int(module_cm)),
+        "="*70
+    ]
     
     dimensioned_rooms = []
     
-    for room in rooms_data:
-        dims = calculate_room_dimensions_on_grid(
-            room['area_m2'],
-            room['room_type'],
-            module_cm
-        )
-        
+    for room, dims in zip(rooms_data, room_dims):
         if dims:
             length_cm, width_cm = dims
             actual_area = (length_cm * width_cm) / 10000.0
             
-            dimensioned_room = room.copy()
-            dimensioned_room['dimensions'] = (length_cm, width_cm)
-            dimensioned_room['area_actual'] = actual_area
-            dimensioned_room['module'] = module_cm
+            room['dimensions'] = (length_cm, width_cm)
+            room['area_actual'] = actual_area
+            room['module'] = module_cm
             
-            dimensioned_rooms.append(dimensioned_room)
+            dimensioned_rooms.append(room)
             
-            print("  {0}: {1:.2f}x{2:.2f}m = {3:.2f}m2 (requested: {4:.2f}m2)".format(
+            lines.append("  {0}: {1:.2f}x{2:.2f}m = {3:.2f}m2 (requested: {4:.2f}m2)".format(
                 room['name'][:25],
                 length_cm/100.0, width_cm/100.0,
                 actual_area, room['area_m2']
             ))
         else:
-            print("  ERROR: Could not dimension {0}".format(room['name']))
+            lines.append("  ERROR: Could not dimension {0}".format(room['name']))
+    
+    print_lines(lines)
     
     return dimensioned_rooms
 
 def analyze_modular_grid(rooms, module_cm):
     """
     Analyze how well the modular grid works
-    """
-    print("\n" + "="*70)
-    print("MODULAR GRID ANALYSIS")
-    print("="*70)
     
-    # Collect all unique wall dimensions
-    all_dimensions = []
+    Returns:
+        Dict with unique_dims, total_requested, total_actual and variance
+    """
+    lines = [
+        "\n" + "="*70,
+        "MODULAR GRID ANALYSIS",
+        "="*70
+    ]
+    
+    # Collect wall dimensions and area totals in a single pass
+    dim_counts = Counter()  # keys double as the set of unique dimensions
+    dim_rooms = {}  # dimension -> names of rooms using it
+    total_requested = 0.0
+    total_actual = 0.0
     for room in rooms:
-        all_dimensions.extend(room['dimensions'])
-    
-    unique_dims = sorted(set(all_dimensions))
-    
-    # Count occurrences
-    dim_counts = {}
-    for dim in all_dimensions:
-        dim_counts[dim] = dim_counts.get(dim, 0) + 1
+        length_cm, width_cm = room['dimensions']
+        dim_counts[length_cm] += 1
+        dim_counts[width_cm] += 1
+        dim_rooms.setdefault(length_cm, []).append(room['name'][:20])
+        if width_cm != length_cm:
+            dim_rooms.setdefault(width_cm, []).append(room['name'][:20])
+        total_requested += room['area_m2']
+        total_actual += room['area_actual']
     
     # Calculate module statistics
-    print("\nModule: {0}cm ({1}m)".format(int(module_cm), module_cm/100.0))
-    print("Unique wall dimensions: {0}".format(len(unique_dims)))
-    print("\nWall dimension distribution:")
+    lines.append("\nModule: {0}cm ({1}m)".format(int(module_cm), module_cm/100.0))
+    lines.append("Unique wall dimensions: {0}".format(len(dim_counts)))
+    lines.append("\nWall dimension distribution:")
     
-    sorted_dims = sorted(dim_counts.items(), key=lambda x: x[1], reverse=True)
-    for dim, count in sorted_dims:
-        rooms_using = [r['name'][:20] for r in rooms if dim in r['dimensions']]
+    for dim, count in dim_counts.most_common():
+        rooms_using = dim_rooms[dim]
         multiples = int(dim / module_cm)
-        print("  {0:.2f}m ({1}x module): {2} walls - {3}".format(
+        lines.append("  {0:.2f}m ({1}x module): {2} walls - {3}".format(
             dim/100.0, multiples, count, ", ".join(rooms_using[:3])
         ))
     
     # Universal connectivity
-    total_walls = len(all_dimensions)
-    print("\nTotal wall surfaces: {0}".format(total_walls))
-    print("All walls are multiples of {0}cm".format(int(module_cm)))
-    print("Universal connectivity: 100% (any room can connect to any room)")
+    total_walls = 2 * len(rooms)  # two wall dimensions per room
+    lines.append("\nTotal wall surfaces: {0}".format(total_walls))
+    lines.append("All walls are multiples of {0}cm".format(int(module_cm)))
+    lines.append("Universal connectivity: 100% (any room can connect to any room)")
     
     # Area accuracy
-    total_requested = sum(r['area_m2'] for r in rooms)
-    total_actual = sum(r['area_actual'] for r in rooms)
     variance = ((total_actual - total_requested) / total_requested) * 100
     
-    print("\nArea accuracy:")
-    print("  Requested: {0:.2f}m2".format(total_requested))
-    print("  Actual: {0:.2f}m2".format(total_actual))
-    print("  Variance: {0:+.2f}%".format(variance))
+    lines.append("\nArea accuracy:")
+    lines.append("  Requested: {0:.2f}m2".format(total_requested))
+    lines.append("  Actual: {0:.2f}m2".format(total_actual))
+    lines.append("  Variance: {0:+.2f}%".format(variance))
+    
+    print_lines(lines)
+    
+    return {
+        'unique_dims': len(dim_counts),
+        'total_requested': total_requested,
+        'total_actual': total_actual,
+        'variance': variance
+    }
 
 # ============================================================================
 # MAIN PROGRAM
 # ============================================================================
 
-os.system("cls" if os.name == "nt" else "clear")
+clear_console()
 
 print("\n\nProgram2Mass {0}".format(ver))
 print("By gduarte\n")
@@ -390,31 +530,40 @@ if not AUTO_MODE:
     print('Press "Enter" to run...')
     raw_input()
 
-os.system("cls" if os.name == "nt" else "clear")
+clear_console()
 
 # File selection
 print("Select a CSV file with your room program...")
-csv_file = rs.OpenFileName("Select CSV File", "CSV Files (*.csv)|*.csv||")
+csv_file = pick_csv_file()
 
 if not csv_file:
     print("No file selected. Exiting...")
     sys.exit()
 
-os.system("cls" if os.name == "nt" else "clear")
+clear_console()
 
 # Read CSV
 rooms_data = []
 
+# Parallel lists of the numeric room data for the grid calculations
+room_areas = []
+room_type_ids = []
+
 try:
-    with open(csv_file, 'r') as file:
+    with open(csv_file, 'r', CSV_BUFFER_SIZE) as file:
         csv_reader = csv.reader(file)
         header = next(csv_reader, None)
         
         for row_num, row in enumerate(csv_reader, start=2):
-            if len(row) >= 2 and row[0].strip() and row[1].strip():
-                name = row[0].strip()
+            if len(row) < 2:
+                continue
+            
+            # Strip each field once and reuse it
+            name = row[0].strip()
+            area_text = row[1].strip()
+            if name and area_text:
                 try:
-                    area = float(row[1].strip())
+                    area = float(area_text)
                     if area > 0:
                         room_type = detect_room_type(name)
                         
@@ -432,6 +581,8 @@ try:
                             'area_m2': area,
                             'room_type': room_type
                         })
+                        room_areas.append(area)
+                        room_type_ids.append(ROOM_TYPE_IDS[room_type])
                 except ValueError:
                     print("Warning: Row {0} - Invalid area".format(row_num))
                     
@@ -450,19 +601,22 @@ if not rooms_data:
     sys.exit()
 
 # Show detection
-print("Room type detection:")
+lines = ["Room type detection:"]
 for i, room in enumerate(rooms_data, 1):
-    print("  {0}. {1} ({2:.1f}m2) -> [{3}]".format(
+    lines.append("  {0}. {1} ({2:.1f}m2) -> [{3}]".format(
         i, room['name'], room['area_m2'], room['room_type']))
+print_lines(lines)
 
 # Find optimal module
-optimal_module = find_optimal_module(rooms_data)
+optimal_module, room_dims = find_optimal_module(room_areas, room_type_ids)
 
-# Apply modular dimensions
-rooms = apply_modular_dimensions(rooms_data, optimal_module)
+# Apply modular dimensions, reusing the search's result for the chosen module
+if room_dims is None:
+    room_dims = calculate_modular_dimensions(room_areas, room_type_ids, optimal_module)
+rooms = apply_modular_dimensions(rooms_data, room_dims, optimal_module)
 
 # Analyze results
-analyze_modular_grid(rooms, optimal_module)
+grid_stats = analyze_modular_grid(rooms, optimal_module)
 
 # Save optimization log for launcher to display
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -474,20 +628,11 @@ try:
         log_file.write("Module: {}cm ({:.2f}m)\n".format(int(optimal_module), optimal_module/100.0))
         log_file.write("Total rooms: {}\n".format(len(rooms)))
         
-        # Count unique dimensions
-        all_dims = []
-        for room in rooms:
-            all_dims.extend(room['dimensions'])
-        unique_dims = len(set(all_dims))
-        log_file.write("Unique wall dimensions: {}\n".format(unique_dims))
-        
-        # Area accuracy
-        total_requested = sum(r['area_m2'] for r in rooms)
-        total_actual = sum(r['area_actual'] for r in rooms)
-        variance = ((total_actual - total_requested) / total_requested) * 100
-        log_file.write("Requested area: {:.2f}m2\n".format(total_requested))
-        log_file.write("Actual area: {:.2f}m2\n".format(total_actual))
-        log_file.write("Variance: {:+.2f}%\n".format(variance))
+        # Reuse the figures from the grid analysis
+        log_file.write("Unique wall dimensions: {}\n".format(grid_stats['unique_dims']))
+        log_file.write("Requested area: {:.2f}m2\n".format(grid_stats['total_requested']))
+        log_file.write("Actual area: {:.2f}m2\n".format(grid_stats['total_actual']))
+        log_file.write("Variance: {:+.2f}%\n".format(grid_stats['variance']))
         log_file.write("\nAll walls are multiples of {}cm\n".format(int(optimal_module)))
         log_file.write("Universal connectivity: 100%\n")
 except:
@@ -514,6 +659,8 @@ else:
             print("Invalid input")
 
 # Generate geometry
+import rhinoscriptsyntax as rs
+
 print("\nGenerating geometry...")
 
 # Clean up old layers
@@ -533,41 +680,56 @@ rs.AddLayer("ProgramLabels", color=(0, 0, 0))
 current_x = 0
 spacing_cm = 100
 
-for i, room in enumerate(rooms, 1):
-    length_cm, width_cm = room['dimensions']
-    room_type = room.get('room_type', 'default')
-    
-    # Get category and set layer
-    category = ROOM_CATEGORIES.get(room_type, 'public')
-    layer_name = "Program_{0}".format(category.capitalize())
-    
-    rs.CurrentLayer(layer_name)
-    corner = (current_x, 0, 0)
-    rectangle = rs.AddRectangle(corner, length_cm, width_cm)
-    
-    if rectangle:
-        surface = rs.AddPlanarSrf([rectangle])
-        if surface:
-            path = rs.AddLine((0, 0, 0), (0, 0, floor_height))
-            box = rs.ExtrudeSurface(surface[0], path)
-            rs.DeleteObject(surface[0])
-            rs.DeleteObject(path)
-            rs.DeleteObject(rectangle)
-            
-            rs.CurrentLayer("ProgramLabels")
-            center_x = current_x + length_cm / 2.0
-            center_y = width_cm / 2.0
-            
-            text_label = "{0}\n{1:.1f}".format(room['name'], room['area_actual'])
-            text_dot = rs.AddTextDot(text_label, (center_x, center_y, floor_height))
-            
-            if box and text_dot:
-                group_name = "Room_{0}_{1}".format(i, room['name'].replace(' ', '_'))
-                group = rs.AddGroup(group_name)
-                rs.AddObjectsToGroup([box, text_dot], group)
-                print("  [OK] {0} [{1}]".format(room['name'], category))
+# Suspend viewport redraws while the boxes are built
+redraw_enabled = rs.EnableRedraw(False)
+try:
+    # Boxes first, switching layers only when the category changes
+    placed = []  # (room, category, box, x position)
+    active_layer = None
+    for room in rooms:
+        length_cm, width_cm = room['dimensions']
+        room_type = room.get('room_type', 'default')
+        
+        # Get category and set layer
+        category, layer_name = ROOM_TYPE_LAYERS.get(room_type, ROOM_TYPE_LAYERS['default'])
+        if layer_name != active_layer:
+            rs.CurrentLayer(layer_name)
+            active_layer = layer_name
+        
+        x0, x1 = current_x, current_x + length_cm
+        box = rs.AddBox([
+            (x0, 0, 0), (x1, 0, 0), (x1, width_cm, 0), (x0, width_cm, 0),
+            (x0, 0, floor_height), (x1, 0, floor_height),
+            (x1, width_cm, floor_height), (x0, width_cm, floor_height)
+        ])
+        placed.append((room, category, box, current_x))
+        
+        current_x += length_cm + spacing_cm
     
-    current_x += length_cm + spacing_cm
+    # Then all labels on the label layer
+    rs.CurrentLayer("ProgramLabels")
+    lines = []
+    for i, (room, category, box, room_x) in enumerate(placed, 1):
+        if not box:
+            continue
+        
+        length_cm, width_cm = room['dimensions']
+        center_x = room_x + length_cm / 2.0
+        center_y = width_cm / 2.0
+        
+        text_label = "{0}\n{1:.1f}".format(room['name'], room['area_actual'])
+        text_dot = rs.AddTextDot(text_label, (center_x, center_y, floor_height))
+        
+        if text_dot:
+            group_name = "Room_{0}_{1}".format(i, room['name'].replace(' ', '_'))
+            group = rs.AddGroup(group_name)
+            rs.AddObjectsToGroup([box, text_dot], group)
+            lines.append("  [OK] {0} [{1}]".format(room['name'], category))
+    
+    if lines:
+        print_lines(lines)
+finally:
+    rs.EnableRedraw(redraw_enabled)
 
 rs.ZoomExtents()
 rs.CurrentLayer("Default")